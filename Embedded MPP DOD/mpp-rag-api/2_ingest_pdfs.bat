@@ -5,6 +5,7 @@ echo ========================================
 echo.
 echo This will process all PDFs and create the vector database.
 echo This only needs to run ONCE (or when PDFs are updated).
+echo Re-running replaces the existing database - restart the server afterwards.
 echo.
 echo Starting ingestion...
 echo.
@@ -0,0 +1,18 @@
+@echo off
+echo ========================================
+echo MPP RAG - Building Module Alignment
+echo ========================================
+echo.
+echo This precomputes module-to-core alignment for /cross_reference.
+echo Run it again after 2_ingest_pdfs.bat.
+echo To also cache LLM verdicts per module page (one paid call each):
+echo   python build_alignment.py --verdicts
+echo.
+
+python build_alignment.py
+
+echo.
+echo Alignment complete!
+echo Restart is not needed - the server picks up the new table.
+echo.
+pause
@@ -0,0 +1,7 @@
+"""
+Alignment Table Paths
+Files written by build_alignment.py and read by the API server
+"""
+
+ALIGNMENT_PATH = "alignment_matrix.npz"
+VERDICTS_PATH = "alignment_verdicts.json"
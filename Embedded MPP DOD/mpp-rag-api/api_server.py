@@ -4,16 +4,23 @@ Provides endpoints for querying, extracting, and cross-referencing DoD MPP docum
 """
 
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict
 import chromadb
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
 from rank_bm25 import BM25Okapi
 import numpy as np
 from pathlib import Path
+from itertools import islice, chain
+import time
+import json
+from functools import lru_cache
+from citation_verifier import verify_answer
+from dedup import get_locations
+from alignment_paths import ALIGNMENT_PATH, VERDICTS_PATH
+from upstream import UpstreamClient, LatencyTracker
 
 # Explicitly load .env from current directory
 env_path = Path(__file__).parent / '.env'
@@ -26,7 +33,8 @@ app = FastAPI(
 )
 
 # Initialize clients
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+upstream = UpstreamClient(api_key=os.getenv("OPENAI_API_KEY"))
+query_latency = LatencyTracker(counters=("calls", "errors"))
 chroma_client = chromadb.PersistentClient(path="./chroma_db")
 collection = chroma_client.get_collection(name="mpp_documents")
 
@@ -36,15 +44,32 @@ class QueryRequest(BaseModel):
     top_k: int = Field(5, description="Number of sources to retrieve")
     doc_type: Optional[str] = Field(None, description="Filter by 'core' or 'module'")
     include_context: bool = Field(True, description="Include full context in response")
+    expand_duplicates: bool = Field(False, description="List every (document, page) location of deduplicated sources")
 
 class ExtractRequest(BaseModel):
     document: str = Field(..., description="Document name (e.g., 'MPP SOP.pdf')")
     page: Optional[int] = Field(None, description="Specific page number")
     search_term: Optional[str] = Field(None, description="Search for specific term")
+    cursor: Optional[str] = Field(None, description="Resume from a next_cursor returned by a previous call")
+    page_size: int = Field(100, ge=1, le=1000, description="Maximum extracts per response (use stream for larger exports)")
+    stream: bool = Field(False, description="Stream every extract as NDJSON instead of one page of results")
 
 class CrossReferenceRequest(BaseModel):
     query: str = Field(..., description="What to cross-reference")
     module_name: Optional[str] = Field(None, description="Specific module to check")
+    use_precomputed: bool = Field(False, description="Return the precomputed alignment report for module_name instead of a query-based comparison")
+
+class CitationCheck(BaseModel):
+    quote: str
+    verified: bool
+    start: Optional[int] = Field(None, description="Match start offset in the full chunk text (Source.quote may be truncated)")
+    end: Optional[int] = Field(None, description="Match end offset in the full chunk text (Source.quote may be truncated)")
+    matched_text: Optional[str] = Field(None, description="Source text the quote matched")
+
+class Location(BaseModel):
+    document: str
+    page: int
+    chunk_index: int
 
 class Source(BaseModel):
     quote: str
@@ -52,6 +77,10 @@ class Source(BaseModel):
     page: int
     confidence: float
     doc_type: str
+    cited: bool = Field(False, description="Source is referenced as [n] in the answer")
+    citation_verified: Optional[bool] = Field(None, description="All quotes attributed to this source were found in it")
+    citations: List[CitationCheck] = []
+    locations: Optional[List[Location]] = Field(None, description="All locations of this text (expand_duplicates only)")
 
 class QueryResponse(BaseModel):
     query: str
@@ -62,18 +91,187 @@ class QueryResponse(BaseModel):
 # Helper Functions
 def get_embedding(text: str) -> List[float]:
     """Get embedding from OpenAI"""
-    response = client.embeddings.create(
-        model=os.getenv("EMBEDDING_MODEL", "text-embedding-3-large"),
-        input=text
+    return upstream.embed(text, model=os.getenv("EMBEDDING_MODEL", "text-embedding-3-large"))
+
+@lru_cache(maxsize=1)
+def duplicate_aliases() -> Dict[str, List[Dict]]:
+    """
+    Map document -> chunks stored under another document's copy of the same text
+
+    Deduplicated chunks are stored once under their first location, so document-level
+    reads merge these in to stay complete. Only changes on re-ingest, so cached.
+    """
+    results = collection.get(
+        where={"duplicate_count": {"$gt": 1}},
+        include=["documents", "metadatas"]
     )
-    return response.data[0].embedding
+    aliases: Dict[str, List[Dict]] = {}
+    for chunk_id, text, meta in zip(results['ids'], results['documents'], results['metadatas']):
+        for loc in get_locations(meta)[1:]:
+            aliases.setdefault(loc["document"], []).append({
+                "id": chunk_id,
+                **at_location(text, meta, loc)
+            })
+    return aliases
 
-def hybrid_search(query: str, top_k: int = 10, doc_type: Optional[str] = None) -> List[Dict]:
+def at_location(text: str, metadata: Dict, location: Dict) -> Dict:
+    """A stored chunk re-pointed at one of its locations, with that copy's own text"""
+    return {
+        "text": location.get("text", text),
+        "metadata": {**metadata, **{k: v for k, v in location.items() if k != "text"}}
+    }
+
+def match_document(text: str, metadata: Dict, document: str, page: Optional[int] = None) -> Optional[Dict]:
+    """The chunk at its location in document (and page), or None if it has none there"""
+    for loc in get_locations(metadata):
+        if loc["document"] == document and (not page or loc["page"] == page):
+            return at_location(text, metadata, loc)
+    return None
+
+def query_document(query_embedding: List[float], n_results: int, document: str,
+                   page: Optional[int] = None, doc_type: Optional[str] = None) -> List[Dict]:
+    """
+    Nearest chunks located in a document (and page), nearest first
+
+    Deduplicated chunks may be stored under another document, so this runs two queries:
+    one filtered on the document itself, and one over deduplicated chunks kept only if
+    they have a location there. Shared boilerplate from other documents therefore
+    cannot crowd out the document's own chunks.
+    """
+    own = [{"document": {"$eq": document}}]
+    if page:
+        own.append({"page": {"$eq": page}})
+    shared = [{"duplicate_count": {"$gt": 1}}]
+    if doc_type:
+        own.append({"doc_type": doc_type})
+        shared.append({"doc_type": doc_type})
+
+    chunks: Dict[str, Dict] = {}
+    for filters in (own, shared):
+        results = collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            where={"$and": filters} if len(filters) > 1 else filters[0]
+        )
+        for chunk_id, text, meta, distance in zip(results['ids'][0], results['documents'][0],
+                                                  results['metadatas'][0], results['distances'][0]):
+            chunk = match_document(text, meta, document, page)
+            if chunk is not None and chunk_id not in chunks:
+                chunks[chunk_id] = {**chunk, 'distance': distance, 'id': chunk_id}
+
+    return sorted(chunks.values(), key=lambda c: c['distance'])
+
+def load_alignment() -> Optional[Dict]:
+    """Precomputed module -> core alignment table from build_alignment.py, if built"""
+    if not os.path.exists(ALIGNMENT_PATH):
+        return None
+    verdicts_mtime = os.path.getmtime(VERDICTS_PATH) if os.path.exists(VERDICTS_PATH) else None
+    return _load_alignment(os.path.getmtime(ALIGNMENT_PATH), verdicts_mtime)
+
+@lru_cache(maxsize=1)
+def _load_alignment(alignment_mtime: float, verdicts_mtime: Optional[float]) -> Dict:
+    """Load the table once per build (keyed on file mtimes)"""
+    with np.load(ALIGNMENT_PATH) as table:
+        alignment = {name: table[name] for name in table.files}
+    alignment["verdicts"] = {}
+    if verdicts_mtime is not None:
+        with open(VERDICTS_PATH) as f:
+            alignment["verdicts"] = json.load(f)
+    return alignment
+
+def support_threshold() -> float:
+    """Minimum cosine similarity for a module chunk to count as supported by core docs"""
+    return float(os.getenv("SUPPORT_THRESHOLD", 0.5))
+
+def parse_cursor(cursor: str):
+    """Split an extract cursor ("page:chunk_index") into its parts"""
+    try:
+        page, chunk_index = cursor.split(":")
+        return int(page), int(chunk_index)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+
+def iter_document_chunks(document: str, page: Optional[int] = None, cursor: Optional[str] = None):
+    """
+    Yield a document's chunks in (page, chunk_index) order, reading one page at a time
+
+    Memory stays bounded by the largest page regardless of document size. Each extract
+    carries the next_cursor to resume after it.
+    """
+    current, start_chunk = parse_cursor(cursor) if cursor else (page or 1, 0)
+    if page is not None and current != page:
+        return
+
+    aliases: Dict[int, List[Dict]] = {}
+    for alias in duplicate_aliases().get(document, []):
+        aliases.setdefault(alias['metadata']['page'], []).append(alias)
+    last_alias_page = max(aliases, default=0)
+
+    while True:
+        results = collection.get(
+            where={"$and": [{"document": {"$eq": document}}, {"page": {"$eq": current}}]},
+            include=["documents", "metadatas"]
+        )
+        chunks = [
+            {"text": text, "metadata": meta}
+            for text, meta in zip(results['documents'], results['metadatas'])
+        ] + aliases.get(current, [])
+
+        for chunk in sorted(chunks, key=lambda c: c['metadata'].get('chunk_index', 0)):
+            chunk_index = chunk['metadata'].get('chunk_index', 0)
+            if chunk_index < start_chunk:
+                continue
+            yield {
+                "text": chunk['text'],
+                "page": current,
+                "document": document,
+                "chunk_index": chunk_index,
+                "next_cursor": f"{current}:{chunk_index + 1}"
+            }
+
+        if page is not None:
+            return
+
+        # Blank pages are never stored, so only stop once nothing is left after this page
+        if not chunks and current >= last_alias_page:
+            remaining = collection.get(
+                where={"$and": [{"document": {"$eq": document}}, {"page": {"$gt": current}}]},
+                limit=1,
+                include=[]
+            )
+            if not remaining['ids']:
+                return
+
+        current += 1
+        start_chunk = 0
+
+def ndjson_export(extracts, cursor: Optional[str] = None):
+    """
+    Serialize extracts as NDJSON lines for a streamed export
+
+    A final {"next_cursor": null} line marks a complete export. A failure mid-stream
+    cannot change the 200 status, so it ends with an error line carrying the cursor
+    to resume from.
+    """
+    try:
+        for extract in extracts:
+            cursor = extract["next_cursor"]
+            yield json.dumps(extract) + "\n"
+    except Exception as e:
+        yield json.dumps({"error": str(e), "next_cursor": cursor}) + "\n"
+        return
+    yield json.dumps({"next_cursor": None}) + "\n"
+
+def hybrid_search(query: str, top_k: int = 10, doc_type: Optional[str] = None,
+                  document: Optional[str] = None) -> List[Dict]:
     """Combine semantic and keyword search for better accuracy"""
 
     # Semantic search with ChromaDB
     query_embedding = get_embedding(query)
 
+    if document:
+        return query_document(query_embedding, top_k * 2, document, doc_type=doc_type)[:top_k]
+
     where_filter = {"doc_type": doc_type} if doc_type else None
 
     results = collection.query(
@@ -124,7 +322,7 @@ Context from MPP Documentation:
 
 Provide a detailed answer with exact citations."""
 
-    response = client.chat.completions.create(
+    return upstream.chat(
         model=os.getenv("LLM_MODEL", "gpt-4"),
         messages=[
             {"role": "system", "content": system_prompt},
@@ -133,8 +331,6 @@ Provide a detailed answer with exact citations."""
         # GPT-5 only supports default temperature of 1
     )
 
-    return response.choices[0].message.content
-
 # API Endpoints
 
 @app.get("/")
@@ -149,7 +345,9 @@ async def root():
             "query": "/query - Ask questions with citations",
             "extract": "/extract - Get exact quotes from documents",
             "cross_reference": "/cross_reference - Compare modules vs core docs",
-            "health": "/health - System status"
+            "unsupported": "/cross_reference/unsupported - Module content without core support",
+            "health": "/health - System status",
+            "metrics": "/metrics - Upstream and query latency"
         }
     }
 
@@ -167,13 +365,27 @@ async def health_check():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/metrics")
+async def metrics():
+    """Latency percentiles, retries and hedging counters per stage"""
+    return {
+        "query": query_latency.summary(),
+        **upstream.metrics()
+    }
+
+# Endpoints that call OpenAI are plain `def` so FastAPI runs them in its threadpool:
+# blocking upstream calls (up to LLM_TIMEOUT) must not stall the event loop, and
+# concurrent requests are what keep the upstream connection pool busy.
+
 @app.post("/query", response_model=QueryResponse)
-async def query_documents(request: QueryRequest):
+def query_documents(request: QueryRequest):
     """
     Query the MPP documentation with exact citations
 
     Returns synthesized answer with source citations and confidence scores
     """
+    query_start = time.perf_counter()
+    query_latency.count("calls")
     try:
         # Retrieve relevant sources
         sources = hybrid_search(
@@ -185,20 +397,33 @@ async def query_documents(request: QueryRequest):
         if not sources:
             raise HTTPException(status_code=404, detail="No relevant documents found")
 
+        retrieval_ms = (time.perf_counter() - query_start) * 1000
+
         # Generate answer with citations
+        generation_start = time.perf_counter()
         answer = generate_answer(request.question, sources)
+        generation_ms = (time.perf_counter() - generation_start) * 1000
+
+        # Verify quotes and [n] references against the cited chunk text
+        verify_start = time.perf_counter()
+        verification = verify_answer(answer, [s['text'] for s in sources])
+        verify_ms = (time.perf_counter() - verify_start) * 1000
 
         # Format sources
-        formatted_sources = [
-            Source(
+        formatted_sources = []
+        for i, s in enumerate(sources):
+            checks = verification["checks"][i]
+            formatted_sources.append(Source(
                 quote=s['text'][:500] + "..." if len(s['text']) > 500 else s['text'],
                 document=s['metadata']['document'],
                 page=s['metadata']['page'],
                 confidence=1.0 - (s['distance'] / 2.0),  # Convert distance to confidence
-                doc_type=s['metadata']['doc_type']
-            )
-            for s in sources
-        ]
+                doc_type=s['metadata']['doc_type'],
+                cited=(i + 1) in verification["referenced"],
+                citation_verified=all(c["verified"] for c in checks) if checks else None,
+                citations=[CitationCheck(**c) for c in checks],
+                locations=[Location(**loc) for loc in get_locations(s['metadata'])] if request.expand_duplicates else None
+            ))
 
         return QueryResponse(
             query=request.question,
@@ -207,67 +432,90 @@ async def query_documents(request: QueryRequest):
             metadata={
                 "total_sources": len(sources),
                 "doc_filter": request.doc_type,
-                "model": os.getenv("LLM_MODEL", "gpt-4")
+                "model": os.getenv("LLM_MODEL", "gpt-4"),
+                "citation_verification": {
+                    "quotes_checked": verification["quotes_checked"],
+                    "quotes_verified": verification["quotes_verified"],
+                    "invalid_references": verification["invalid_references"],
+                    "unattributed_quotes": verification["unattributed_quotes"]
+                },
+                "timings_ms": {
+                    "retrieval": round(retrieval_ms, 1),
+                    "generation": round(generation_ms, 1),
+                    "verification": round(verify_ms, 3)
+                }
             }
         )
 
     except Exception as e:
+        query_latency.count("errors")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Failed queries count toward the percentiles too
+        query_latency.record(time.perf_counter() - query_start)
 
 @app.post("/extract")
-async def extract_from_document(request: ExtractRequest):
+def extract_from_document(request: ExtractRequest):
     """
     Extract exact text from specific document/page
 
-    Returns verbatim text from the specified document
+    Returns verbatim text from the specified document. Whole-document reads are
+    paginated with next_cursor, or streamed in page order as NDJSON with stream=true.
     """
     try:
-        # Build filter with proper ChromaDB syntax
-        if request.page:
-            where_filter = {
-                "$and": [
-                    {"document": {"$eq": request.document}},
-                    {"page": {"$eq": request.page}}
-                ]
+        if not request.search_term:
+            chunks = iter_document_chunks(request.document, page=request.page, cursor=request.cursor)
+            first = next(chunks, None)
+
+            if first is None and not request.cursor:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"No content found for {request.document}" +
+                           (f" page {request.page}" if request.page else "")
+                )
+
+            if request.stream:
+                remaining = [first] if first else []
+                return StreamingResponse(
+                    ndjson_export(chain(remaining, chunks), request.cursor),
+                    media_type="application/x-ndjson"
+                )
+
+            extracts = ([first] if first else []) + list(islice(chunks, request.page_size))
+            next_cursor = None
+            if len(extracts) > request.page_size:
+                extracts = extracts[:request.page_size]
+                next_cursor = extracts[-1]["next_cursor"]
+
+            return {
+                "document": request.document,
+                "page": request.page,
+                "search_term": request.search_term,
+                "total_extracts": len(extracts),
+                "extracts": extracts,
+                "next_cursor": next_cursor
             }
-        else:
-            where_filter = {"document": {"$eq": request.document}}
-
-        # Query collection
-        if request.search_term:
-            # Search for specific term
-            query_embedding = get_embedding(request.search_term)
-            results = collection.query(
-                query_embeddings=[query_embedding],
-                n_results=10,
-                where=where_filter
-            )
-        else:
-            # Get all chunks from document/page
-            results = collection.get(
-                where=where_filter,
-                limit=100
-            )
 
-        if not results or (isinstance(results, dict) and not results.get('documents')):
-            raise HTTPException(
-                status_code=404,
-                detail=f"No content found for {request.document}" +
-                       (f" page {request.page}" if request.page else "")
-            )
+        # Search for specific term, including deduplicated copies stored under other documents
+        query_embedding = get_embedding(request.search_term)
+        chunks = query_document(query_embedding, 10, request.document, page=request.page)
 
         # Format results
         extracts = []
-        docs = results['documents'] if isinstance(results['documents'][0], str) else results['documents'][0]
-        metas = results['metadatas'] if isinstance(results['metadatas'][0], dict) else results['metadatas'][0]
-
-        for i, doc in enumerate(docs):
+        for chunk in chunks[:10]:
             extracts.append({
-                "text": doc,
-                "page": metas[i]['page'],
-                "document": metas[i]['document']
+                "text": chunk['text'],
+                "page": chunk['metadata']['page'],
+                "document": chunk['metadata']['document']
             })
 
+        if not extracts:
+            raise HTTPException(
+                status_code=404,
+                detail=f"No content found for {request.document}" +
+                       (f" page {request.page}" if request.page else "")
+            )
+
         # Sort by page
         extracts.sort(key=lambda x: x['page'])
 
@@ -285,22 +533,27 @@ async def extract_from_document(request: ExtractRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/cross_reference")
-async def cross_reference(request: CrossReferenceRequest):
+def cross_reference(request: CrossReferenceRequest):
     """
     Cross-reference modules against core documents
 
     Checks if module content aligns with core MPP SOP and Appendix I
     """
     try:
-        # Search in modules
-        module_filter = {"doc_type": "module"}
-        if request.module_name:
-            module_filter["document"] = request.module_name
+        if request.use_precomputed:
+            if not request.module_name:
+                raise HTTPException(status_code=400, detail="use_precomputed requires module_name")
+            alignment = load_alignment()
+            if alignment is None:
+                raise HTTPException(status_code=503, detail="Alignment table not built - run build_alignment.py")
+            return module_alignment_report(request.module_name, alignment)
 
+        # Search in modules
         module_results = hybrid_search(
             request.query,
             top_k=5,
-            doc_type="module"
+            doc_type="module",
+            document=request.module_name
         )
 
         # Search in core docs
@@ -345,7 +598,7 @@ Analyze:
 
 Be specific and cite page numbers."""
 
-        response = client.chat.completions.create(
+        alignment_analysis = upstream.chat(
             model=os.getenv("LLM_MODEL", "gpt-4"),
             messages=[
                 {"role": "system", "content": "You are analyzing alignment between DoD MPP modules and core documentation."},
@@ -359,16 +612,102 @@ Be specific and cite page numbers."""
             "module_filter": request.module_name,
             "module_sources": module_sources,
             "core_sources": core_sources,
-            "alignment_analysis": response.choices[0].message.content,
+            "alignment_analysis": alignment_analysis,
             "metadata": {
                 "modules_checked": len(module_results),
                 "core_references": len(core_results)
             }
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def module_alignment_report(module_name: str, alignment: Dict) -> Dict:
+    """Build a module-level alignment report from the precomputed table"""
+    rows = np.nonzero(alignment["loc_documents"] == module_name)[0]
+    if len(rows) == 0:
+        raise HTTPException(status_code=404, detail=f"No alignment data for {module_name}")
+
+    threshold = support_threshold()
+    sections: Dict[int, List[Dict]] = {}
+    for loc in rows:
+        row = alignment["loc_rows"][loc]
+        matches = [
+            {
+                "document": str(alignment["core_documents"][c]),
+                "page": int(alignment["core_pages"][c]),
+                "score": round(float(score), 3)
+            }
+            for c, score in zip(alignment["neighbors"][row], alignment["scores"][row])
+        ]
+        sections.setdefault(int(alignment["loc_pages"][loc]), []).append({
+            "chunk_id": str(alignment["module_ids"][row]),
+            "supported": matches[0]["score"] >= threshold,
+            "core_matches": matches
+        })
+
+    report = []
+    for page in sorted(sections):
+        verdict = alignment["verdicts"].get(f"{module_name}|{page}")
+        report.append({
+            "page": page,
+            "supported": all(chunk["supported"] for chunk in sections[page]),
+            "chunks": sections[page],
+            "alignment_analysis": verdict["verdict"] if verdict else None
+        })
+
+    return {
+        "module_filter": module_name,
+        "sections": report,
+        "metadata": {
+            "precomputed": True,
+            "support_threshold": threshold,
+            "sections_checked": len(report),
+            "unsupported_sections": sum(1 for section in report if not section["supported"])
+        }
+    }
+
+@app.get("/cross_reference/unsupported")
+async def unsupported_module_content(min_score: Optional[float] = None):
+    """
+    Corpus-wide report of module content without close core document support
+
+    Lists module pages whose best core match falls below the support threshold
+    """
+    alignment = load_alignment()
+    if alignment is None:
+        raise HTTPException(status_code=503, detail="Alignment table not built - run build_alignment.py")
+
+    threshold = support_threshold() if min_score is None else min_score
+    best = alignment["scores"][:, 0].astype(np.float32)
+
+    modules: Dict[str, Dict[int, float]] = {}
+    for doc, page, row in zip(alignment["loc_documents"], alignment["loc_pages"], alignment["loc_rows"]):
+        score = float(best[row])
+        if score < threshold:
+            pages = modules.setdefault(str(doc), {})
+            pages[int(page)] = min(score, pages.get(int(page), score))
+
+    return {
+        "support_threshold": threshold,
+        "modules": [
+            {
+                "document": doc,
+                "unsupported_pages": [
+                    {"page": page, "best_core_score": round(score, 3)}
+                    for page, score in sorted(pages.items())
+                ]
+            }
+            for doc, pages in sorted(modules.items())
+        ],
+        "metadata": {
+            "module_chunks": len(alignment["module_ids"]),
+            "unsupported_pages": sum(len(pages) for pages in modules.values())
+        }
+    }
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
@@ -0,0 +1,194 @@
+"""
+Module-to-Core Alignment Builder for MPP Documentation
+Precomputes nearest core (SOP / Appendix I) chunks for every module chunk from stored embeddings
+"""
+
+import os
+import json
+import argparse
+import hashlib
+from pathlib import Path
+from typing import List, Dict
+import numpy as np
+import chromadb
+from openai import OpenAI
+from dotenv import load_dotenv
+from dedup import get_locations
+from alignment_paths import ALIGNMENT_PATH, VERDICTS_PATH
+
+# Explicitly load .env from current directory
+env_path = Path(__file__).parent / '.env'
+load_dotenv(dotenv_path=env_path, override=True)
+
+class AlignmentBuilder:
+    def __init__(self, top_k: int = 5, block_size: int = 512):
+        self.top_k = top_k
+        self.block_size = block_size
+
+        self.chroma_client = chromadb.PersistentClient(path="./chroma_db")
+        self.collection = self.chroma_client.get_collection(name="mpp_documents")
+
+    def load_chunks(self, doc_type: str) -> Dict:
+        """Load ids, metadata and L2-normalized embeddings for one doc_type"""
+        results = self.collection.get(
+            where={"doc_type": doc_type},
+            include=["embeddings", "metadatas"]
+        )
+        if not results['ids']:
+            return {"ids": [], "metadatas": [], "embeddings": None}
+
+        embeddings = np.asarray(results['embeddings'], dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return {"ids": results['ids'], "metadatas": results['metadatas'], "embeddings": embeddings}
+
+    def compute_alignment(self, module: Dict, core: Dict):
+        """Top-k cosine neighbors of each module chunk among core chunks, one block of rows at a time"""
+        k = min(self.top_k, len(core["ids"]))
+        core_t = core["embeddings"].T
+        neighbors = np.empty((len(module["ids"]), k), dtype=np.int32)
+        scores = np.empty((len(module["ids"]), k), dtype=np.float16)
+
+        for start in range(0, len(module["ids"]), self.block_size):
+            sims = module["embeddings"][start:start + self.block_size] @ core_t
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            top_sims = np.take_along_axis(sims, top, axis=1)
+            order = np.argsort(-top_sims, axis=1)
+            neighbors[start:start + len(sims)] = np.take_along_axis(top, order, axis=1)
+            scores[start:start + len(sims)] = np.take_along_axis(top_sims, order, axis=1)
+
+        return neighbors, scores
+
+    def build(self) -> Dict:
+        """Compute and persist the sparse module -> core alignment table"""
+        print("\n=== Loading Embeddings ===")
+        module = self.load_chunks("module")
+        core = self.load_chunks("core")
+        print(f"  [OK] {len(module['ids'])} module chunks, {len(core['ids'])} core chunks")
+
+        if not module["ids"] or not core["ids"]:
+            raise ValueError("Both module and core chunks are required - run ingest_pdfs.py first")
+
+        print("\n=== Computing Alignment ===")
+        neighbors, scores = self.compute_alignment(module, core)
+
+        # One row per module location so deduplicated chunks appear under every module
+        loc_documents, loc_pages, loc_rows = [], [], []
+        for row, meta in enumerate(module["metadatas"]):
+            for loc in get_locations(meta):
+                loc_documents.append(loc["document"])
+                loc_pages.append(loc["page"])
+                loc_rows.append(row)
+
+        np.savez_compressed(
+            ALIGNMENT_PATH,
+            module_ids=np.array(module["ids"]),
+            core_ids=np.array(core["ids"]),
+            core_documents=np.array([m["document"] for m in core["metadatas"]]),
+            core_pages=np.array([m["page"] for m in core["metadatas"]], dtype=np.int32),
+            neighbors=neighbors,
+            scores=scores,
+            loc_documents=np.array(loc_documents),
+            loc_pages=np.array(loc_pages, dtype=np.int32),
+            loc_rows=np.array(loc_rows, dtype=np.int32)
+        )
+        print(f"  [OK] Saved {ALIGNMENT_PATH}")
+
+        return {
+            "module_chunks": len(module["ids"]),
+            "core_chunks": len(core["ids"]),
+            "module_locations": len(loc_rows),
+            "top_k": neighbors.shape[1]
+        }
+
+    def build_verdicts(self) -> Dict:
+        """Cache one LLM alignment verdict per module section (document, page)"""
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        model = os.getenv("LLM_MODEL", "gpt-4")
+        table = np.load(ALIGNMENT_PATH)
+
+        verdicts = {}
+        if os.path.exists(VERDICTS_PATH):
+            with open(VERDICTS_PATH) as f:
+                verdicts = json.load(f)
+
+        sections: Dict[str, List[int]] = {}
+        for doc, page, row in zip(table["loc_documents"], table["loc_pages"], table["loc_rows"]):
+            sections.setdefault(f"{doc}|{page}", []).append(int(row))
+
+        print(f"\n=== Generating Verdicts for {len(sections)} Sections ===")
+        for key, rows in sections.items():
+            module_ids = [str(table["module_ids"][r]) for r in rows]
+            core_ids = sorted({str(table["core_ids"][c]) for r in rows for c in table["neighbors"][r]})
+
+            document, page = key.rsplit("|", 1)
+            module_results = self.collection.get(ids=module_ids, include=["documents", "metadatas"])
+            # A near-duplicate chunk carries this section's own copy of the text in its locations
+            module_text = [
+                next((
+                    loc.get("text", d) for loc in get_locations(m)
+                    if loc["document"] == document and loc["page"] == int(page)
+                ), d)
+                for d, m in zip(module_results['documents'], module_results['metadatas'])
+            ]
+            core_results = self.collection.get(ids=core_ids, include=["documents", "metadatas"])
+            core_text = [
+                f"{m['document']} p.{m['page']}: {d}"
+                for d, m in zip(core_results['documents'], core_results['metadatas'])
+            ]
+
+            # Skip sections whose text and neighbors are unchanged since the last run. Chunk ids
+            # depend only on (file, page, index), so the text itself must be part of the fingerprint.
+            fingerprint = hashlib.md5(json.dumps([
+                model,
+                sorted(zip(module_results['ids'], module_text)),
+                sorted(zip(core_results['ids'], core_text))
+            ]).encode()).hexdigest()
+            if verdicts.get(key, {}).get("fingerprint") == fingerprint:
+                continue
+
+            prompt = f"""Compare this module section with the closest core document excerpts.
+
+MODULE: {document} p.{page}
+{chr(10).join(module_text)}
+
+CORE DOCUMENT CONTENT:
+{chr(10).join(core_text)}
+
+Does the module section align with the core documents? List any contradictions or
+module statements not supported by the core documents. Cite page numbers."""
+
+            response = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": "You are analyzing alignment between DoD MPP modules and core documentation."},
+                    {"role": "user", "content": prompt}
+                ]
+            )
+            verdicts[key] = {
+                "fingerprint": fingerprint,
+                "verdict": response.choices[0].message.content
+            }
+            print(f"  [OK] {key}")
+
+            # Save as we go so an interrupted run keeps its progress
+            with open(VERDICTS_PATH, "w") as f:
+                json.dump(verdicts, f, indent=2)
+
+        return {"sections": len(sections), "verdicts": len(verdicts)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute module-to-core alignment")
+    parser.add_argument("--top-k", type=int, default=int(os.getenv("ALIGNMENT_TOP_K", 5)))
+    parser.add_argument("--block-size", type=int, default=512)
+    parser.add_argument("--verdicts", action="store_true", help="Also cache LLM verdicts per module section")
+    args = parser.parse_args()
+
+    builder = AlignmentBuilder(top_k=args.top_k, block_size=args.block_size)
+    summary = builder.build()
+    if args.verdicts:
+        summary.update(builder.build_verdicts())
+
+    print("\n" + "="*50)
+    print("Summary:")
+    print(json.dumps(summary, indent=2))
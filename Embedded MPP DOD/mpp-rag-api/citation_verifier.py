@@ -0,0 +1,186 @@
+"""
+Citation Verifier for MPP RAG answers
+Checks quoted spans and [n] references in generated answers against the cited source text
+"""
+
+import re
+from typing import List, Dict, Tuple, Optional
+
+# Quotes shorter than this many words are too weak to verify and are ignored
+MIN_QUOTE_WORDS = 3
+
+TOKEN_RE = re.compile(r"\w+")
+ELLIPSIS_RE = re.compile(r"\.{3}|…")
+SEPARATOR_RE = re.compile(r"\W+")
+QUOTE_RE = re.compile(r'"([^"\n]+)"|“([^”\n]+)”')
+REFERENCE_RE = re.compile(r"\[(\d+(?:\s*,\s*\d+)*)\]")
+SENTENCE_END_RE = re.compile(r"[.!?](?:\s|$)")
+
+
+def quote_fragments(quote: str) -> Optional[List[List[str]]]:
+    """Lowercase word tokens of each ellipsis-separated part of a quote, or None if too short"""
+    fragments = [[token.lower() for token in TOKEN_RE.findall(part)] for part in ELLIPSIS_RE.split(quote)]
+    fragments = [tokens for tokens in fragments if tokens]
+    if sum(len(tokens) for tokens in fragments) < MIN_QUOTE_WORDS:
+        return None
+    return fragments
+
+
+def _is_word_char(text: str, i: int) -> bool:
+    return 0 <= i < len(text) and (text[i].isalnum() or text[i] == "_")
+
+
+def _match_tokens_at(tokens: List[str], text: str, start: int) -> Optional[int]:
+    """End offset if tokens occur at start separated only by non-word characters"""
+    if _is_word_char(text, start - 1):
+        return None
+    end = start + len(tokens[0])
+    for token in tokens[1:]:
+        separator = SEPARATOR_RE.match(text, end)
+        if not separator or not text.startswith(token, separator.end()):
+            return None
+        end = separator.end() + len(token)
+    return None if _is_word_char(text, end) else end
+
+
+def _find_fragment(tokens: List[str], text: str, pos: int) -> Optional[Tuple[int, int]]:
+    """Earliest occurrence of a fragment at or after pos, anchored on its first word"""
+    start = text.find(tokens[0], pos)
+    while start != -1:
+        end = _match_tokens_at(tokens, text, start)
+        if end is not None:
+            return start, end
+        start = text.find(tokens[0], start + 1)
+    return None
+
+
+def find_quote(fragments: List[List[str]], text: str) -> Optional[Tuple[int, int]]:
+    """
+    Return (start, end) character offsets of a quote in text
+
+    Case, punctuation and whitespace (including PDF line breaks) between words are ignored,
+    and an ellipsis matches any omitted text. The scan uses str.find on the first word of
+    each fragment, so it needs no per-chunk index and unseen chunks cost the same as cached ones.
+    """
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        # Lowercasing changed the length (e.g. "İ"), so offsets into lowered text would not
+        # line up with the original; compare word by word on the original text instead
+        return _find_quote_by_words(fragments, text)
+
+    start, pos = None, 0
+    for tokens in fragments:
+        span = _find_fragment(tokens, lowered, pos)
+        if span is None:
+            return None
+        start = span[0] if start is None else start
+        pos = span[1]
+    return start, pos
+
+
+def _find_quote_by_words(fragments: List[List[str]], text: str) -> Optional[Tuple[int, int]]:
+    """Slower fallback of find_quote that lowercases each word of text separately"""
+    words = [(match.group(0).lower(), match.start(), match.end()) for match in TOKEN_RE.finditer(text)]
+
+    start, i = None, 0
+    for tokens in fragments:
+        n = len(tokens)
+        while i + n <= len(words) and [word for word, _, _ in words[i:i + n]] != tokens:
+            i += 1
+        if i + n > len(words):
+            return None
+        start = words[i][1] if start is None else start
+        i += n
+    return start, words[i - 1][2]
+
+
+def extract_quotes(answer: str) -> List[Dict]:
+    """Find quoted spans in the answer and the [n] references that belong to each"""
+    quotes = []
+    for match in QUOTE_RE.finditer(answer):
+        quote = match.group(1) or match.group(2)
+        fragments = quote_fragments(quote)
+        if fragments is None:
+            continue
+
+        # A quote belongs to the references in the rest of its sentence,
+        # falling back to the ones just before it ("According to [1], "...")
+        end = SENTENCE_END_RE.search(answer, match.end())
+        after = answer[match.end():end.end() if end else len(answer)]
+        refs = _parse_references(after)
+        if not refs:
+            start = max(answer.rfind(".", 0, match.start()), answer.rfind("\n", 0, match.start()))
+            refs = _parse_references(answer[start + 1:match.start()])
+
+        quotes.append({"quote": quote, "fragments": fragments, "references": refs})
+    return quotes
+
+
+def _parse_references(text: str) -> List[int]:
+    """Parse [1], [2, 3] style references into a list of source numbers"""
+    refs = []
+    for match in REFERENCE_RE.finditer(text):
+        for ref in match.group(1).split(","):
+            ref = int(ref)
+            if ref not in refs:
+                refs.append(ref)
+    return refs
+
+
+def verify_answer(answer: str, source_texts: List[str]) -> Dict:
+    """
+    Verify an answer's citations against the numbered source texts
+
+    Returns per-source citation checks (quote, verified flag, match offsets and the
+    matched text), the set of referenced source numbers and any references to missing
+    sources. Offsets index into the full source text.
+    """
+    referenced = _parse_references(answer)
+    invalid = [ref for ref in referenced if not 1 <= ref <= len(source_texts)]
+    checks: List[List[Dict]] = [[] for _ in source_texts]
+    unattributed = []
+    quotes = extract_quotes(answer)
+    verified = 0
+
+    for item in quotes:
+        quote = item["quote"]
+        refs = [ref for ref in item["references"] if 1 <= ref <= len(source_texts)]
+
+        # Check the cited sources first; an uncited quote may match any source
+        matched = False
+        for ref in refs or range(1, len(source_texts) + 1):
+            text = source_texts[ref - 1]
+            span = find_quote(item["fragments"], text)
+            if span:
+                checks[ref - 1].append({
+                    "quote": quote,
+                    "verified": True,
+                    "start": span[0],
+                    "end": span[1],
+                    "matched_text": text[span[0]:span[1]]
+                })
+                matched = True
+                verified += 1
+                break
+
+        if not matched:
+            if refs:
+                for ref in refs:
+                    checks[ref - 1].append({
+                        "quote": quote,
+                        "verified": False,
+                        "start": None,
+                        "end": None,
+                        "matched_text": None
+                    })
+            else:
+                unattributed.append(quote)
+
+    return {
+        "checks": checks,
+        "referenced": [ref for ref in referenced if ref not in invalid],
+        "invalid_references": invalid,
+        "unattributed_quotes": unattributed,
+        "quotes_checked": len(quotes),
+        "quotes_verified": verified,
+    }
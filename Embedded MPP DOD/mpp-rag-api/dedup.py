@@ -0,0 +1,103 @@
+"""
+Near-Duplicate Detection for MPP chunks
+MinHash signatures with LSH banding to group near-identical chunk text at ingest time
+"""
+
+import zlib
+import json
+from typing import List, Dict
+import numpy as np
+
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+class MinHashDeduplicator:
+    def __init__(self, num_perm: int = 128, bands: int = 16, threshold: float = 0.85,
+                 shingle_size: int = 3, min_shingles: int = 5, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.min_shingles = min_shingles
+
+        # Universal hash functions h(x) = (a*x + b) mod p; a*x stays below 2^62
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+
+    def _shingles(self, text: str) -> np.ndarray:
+        """Hash word n-gram shingles of normalized text to 31-bit integers"""
+        words = text.lower().split()
+        n = self.shingle_size
+        shingles = {
+            zlib.crc32(' '.join(words[i:i + n]).encode()) & MERSENNE_PRIME
+            for i in range(max(len(words) - n + 1, 0))
+        }
+        return np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+
+    def signature(self, text: str):
+        """MinHash signature, or None if the text is too short to compare reliably"""
+        shingles = self._shingles(text)
+        if len(shingles) < self.min_shingles:
+            return None
+        hashes = (np.outer(shingles, self.a) + self.b) % MERSENNE_PRIME
+        return hashes.min(axis=0)
+
+    def group(self, chunks: List[Dict]) -> List[List[int]]:
+        """
+        Group chunks whose estimated Jaccard similarity meets the threshold
+
+        Only chunks of the same doc_type are grouped, so core/module filters keep working.
+        Returns index groups in input order; the first index of each group is canonical.
+        """
+        parent = list(range(len(chunks)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        signatures = [self.signature(chunk["text"]) for chunk in chunks]
+        buckets: Dict[tuple, List[int]] = {}
+        for i, sig in enumerate(signatures):
+            if sig is None:
+                continue
+            doc_type = chunks[i]["metadata"]["doc_type"]
+            for band in range(self.bands):
+                key = (doc_type, band, sig[band * self.rows:(band + 1) * self.rows].tobytes())
+                buckets.setdefault(key, []).append(i)
+
+        # Verify LSH candidates against the full signature before merging
+        for members in buckets.values():
+            for j in members[1:]:
+                i = members[0]
+                if find(i) == find(j):
+                    continue
+                if np.mean(signatures[i] == signatures[j]) >= self.threshold:
+                    ri, rj = find(i), find(j)
+                    parent[max(ri, rj)] = min(ri, rj)
+
+        groups: Dict[int, List[int]] = {}
+        for i in range(len(chunks)):
+            groups.setdefault(find(i), []).append(i)
+        return sorted(groups.values(), key=lambda g: g[0])
+
+
+def get_locations(metadata: Dict) -> List[Dict]:
+    """
+    All (document, page, chunk_index) locations of a possibly deduplicated chunk
+
+    Locations whose copy is not an exact match also carry that copy's own "text".
+    """
+    if metadata.get("locations"):
+        return json.loads(metadata["locations"])
+    return [{
+        "document": metadata["document"],
+        "page": metadata["page"],
+        "chunk_index": metadata.get("chunk_index", 0)
+    }]
@@ -13,6 +13,7 @@ from pathlib import Path
 import json
 from typing import List, Dict
 import hashlib
+from dedup import MinHashDeduplicator
 
 # Explicitly load .env from current directory
 env_path = Path(__file__).parent / '.env'
@@ -33,6 +34,7 @@ class PDFIngestion:
         self.embedding_model = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
         self.chunk_size = int(os.getenv("CHUNK_SIZE", 512))
         self.chunk_overlap = int(os.getenv("CHUNK_OVERLAP", 50))
+        self.dedup_threshold = float(os.getenv("DEDUP_THRESHOLD", 0.85))
 
         # Initialize ChromaDB
         self.chroma_client = chromadb.PersistentClient(path="./chroma_db")
@@ -43,6 +45,19 @@ class PDFIngestion:
             metadata={"description": "DoD Mentor-Protege Program Documentation"}
         )
 
+    def reset_collection(self):
+        """
+        Drop and recreate the collection before re-ingesting
+
+        Chunk ids are fixed, and ChromaDB skips add() for ids it already has. Without a reset,
+        duplicate copies from earlier runs stay stored and canonical chunks keep stale metadata.
+        """
+        self.chroma_client.delete_collection(name="mpp_documents")
+        self.collection = self.chroma_client.create_collection(
+            name="mpp_documents",
+            metadata={"description": "DoD Mentor-Protege Program Documentation"}
+        )
+
     def extract_text_from_pdf(self, pdf_path: Path, doc_type: str) -> List[Dict]:
         """Extract text from PDF with page-level tracking"""
         chunks = []
@@ -101,6 +116,34 @@ class PDFIngestion:
         content = f"{filename}_{page}_{chunk_idx}"
         return hashlib.md5(content.encode()).hexdigest()
 
+    def deduplicate_chunks(self, chunks: List[Dict]) -> List[Dict]:
+        """Collapse near-duplicate chunks, keeping every (document, page) location in metadata"""
+        deduplicator = MinHashDeduplicator(threshold=self.dedup_threshold)
+        unique_chunks = []
+
+        for group in deduplicator.group(chunks):
+            canonical = chunks[group[0]]
+            canonical["metadata"]["duplicate_count"] = len(group)
+
+            if len(group) > 1:
+                # ChromaDB metadata values must be scalars, so locations are stored as JSON
+                locations = []
+                for i in group:
+                    location = {
+                        "document": chunks[i]["metadata"]["document"],
+                        "page": chunks[i]["metadata"]["page"],
+                        "chunk_index": chunks[i]["metadata"]["chunk_index"]
+                    }
+                    # Near (not exact) copies keep their own text so /extract stays verbatim
+                    if chunks[i]["text"] != canonical["text"]:
+                        location["text"] = chunks[i]["text"]
+                    locations.append(location)
+                canonical["metadata"]["locations"] = json.dumps(locations)
+
+            unique_chunks.append(canonical)
+
+        return unique_chunks
+
     def get_embeddings(self, texts: List[str]) -> List[List[float]]:
         """Get embeddings from OpenAI"""
         response = self.client.embeddings.create(
@@ -125,22 +168,37 @@ class PDFIngestion:
 
         print(f"\n=== Total Chunks: {len(all_chunks)} ===")
 
+        total_chunks = len(all_chunks)
+        if self.dedup_threshold < 1.0:
+            print("\n=== Removing Near-Duplicate Chunks ===")
+            all_chunks = self.deduplicate_chunks(all_chunks)
+            print(f"  [OK] {total_chunks - len(all_chunks)} duplicates collapsed, {len(all_chunks)} unique chunks")
+
         # Batch process embeddings
         print("\n=== Generating Embeddings ===")
         batch_size = 100
+        embeddings = []
 
         for i in range(0, len(all_chunks), batch_size):
             batch = all_chunks[i:i + batch_size]
-            texts = [chunk["text"] for chunk in batch]
 
             print(f"Processing batch {i//batch_size + 1}/{(len(all_chunks) + batch_size - 1)//batch_size}")
-            embeddings = self.get_embeddings(texts)
+            embeddings.extend(self.get_embeddings([chunk["text"] for chunk in batch]))
+
+        # Only replace the live collection once every embedding exists, so a failed
+        # embedding run leaves the existing database untouched
+        if self.collection.count():
+            print(f"\n=== Replacing Existing Collection ({self.collection.count()} chunks) ===")
+            self.reset_collection()
+
+        for i in range(0, len(all_chunks), batch_size):
+            batch = all_chunks[i:i + batch_size]
 
             # Add to ChromaDB
             self.collection.add(
                 ids=[chunk["id"] for chunk in batch],
-                embeddings=embeddings,
-                documents=texts,
+                embeddings=embeddings[i:i + batch_size],
+                documents=[chunk["text"] for chunk in batch],
                 metadatas=[chunk["metadata"] for chunk in batch]
             )
 
@@ -149,7 +207,10 @@ class PDFIngestion:
 
         # Save summary
         summary = {
-            "total_chunks": len(all_chunks),
+            "total_chunks": total_chunks,
+            "unique_chunks": len(all_chunks),
+            "duplicate_groups": sum(1 for c in all_chunks if c["metadata"].get("duplicate_count", 1) > 1),
+            "dedup_threshold": self.dedup_threshold,
             "core_docs": len(list(self.core_dir.glob("*.pdf"))),
             "module_docs": len(list(self.modules_dir.glob("*.pdf"))),
             "embedding_model": self.embedding_model,
@@ -33,6 +33,110 @@ def test_query():
             print(f"\n[{i}] {source['document']} (Page {source['page']})")
             print(f"Confidence: {source['confidence']:.2f}")
             print(f"Quote: {source['quote'][:200]}...")
+            for check in source['citations']:
+                status = "verified" if check['verified'] else "NOT FOUND"
+                print(f"  \"{check['quote'][:80]}\" -> {status}")
+                if check['verified']:
+                    assert check['end'] > check['start'] and check['matched_text']
+
+        verification = result['metadata']['citation_verification']
+        print(f"\n--- Citation Verification ---")
+        print(json.dumps(verification, indent=2))
+        print(f"Verification time: {result['metadata']['timings_ms']['verification']} ms")
+        assert verification['quotes_verified'] <= verification['quotes_checked']
+    else:
+        print(f"Error: {response.status_code}")
+        print(response.text)
+
+def test_citation_verifier():
+    """Check quote/reference pairing offline (no server needed)"""
+    print("\n=== Testing Citation Verifier ===")
+    from citation_verifier import verify_answer
+
+    sources = [
+        "Mentors must be\neligible for the award of Federal contracts, and hold an active SAM registration.",
+        "A protege must qualify as a small business under its primary NAICS code."
+    ]
+
+    # Reference after the quote, in the same sentence
+    result = verify_answer('Mentors "must be eligible for the award" [1].', sources)
+    assert result['checks'][0][0]['verified'] and result['checks'][0][0]['matched_text'] == "must be\neligible for the award"
+
+    # Reference before the quote ("According to [2], ...")
+    result = verify_answer('According to [2], "qualify as a small business".', sources)
+    assert result['checks'][1][0]['verified']
+
+    # Ellipsis skips omitted text; misattributed quote is flagged on the cited source
+    result = verify_answer('"Mentors must be eligible ... active SAM registration" [1]. "hold an active SAM" [2].', sources)
+    assert result['checks'][0][0]['verified']
+    assert not result['checks'][1][0]['verified']
+
+    # Uncited quotes match any source; unmatched ones are reported; short quotes are ignored
+    result = verify_answer('"primary NAICS code" and "not in any source" and "too short" [3].', sources)
+    assert result['checks'][1][0]['verified']
+    assert result['unattributed_quotes'] == ["not in any source"]
+    assert result['invalid_references'] == [3] and result['quotes_checked'] == 2
+
+    # Text whose lowercase form changes length ("İ") is still checked, with original offsets
+    text = "İSTANBUL office: the mentor must hold an active SAM registration."
+    result = verify_answer('"the mentor must hold" [1] and "İstanbul office, the" [1].', [text])
+    assert [check['matched_text'] for check in result['checks'][0]] == ["the mentor must hold", "İSTANBUL office: the"]
+
+    print("Citation verifier checks passed")
+
+def test_dedup():
+    """Check near-duplicate grouping offline (no server needed)"""
+    print("\n=== Testing Near-Duplicate Detection ===")
+    from dedup import MinHashDeduplicator, get_locations
+
+    base = " ".join(f"word{i}" for i in range(200))
+    near = base.replace("word50 ", "changed50 ").replace("word150 ", "changed150 ")
+    other = " ".join(f"term{i}" for i in range(200))
+
+    def chunk(text, doc_type):
+        return {"text": text, "metadata": {"doc_type": doc_type}}
+
+    chunks = [
+        chunk(base, "core"),
+        chunk(other, "core"),
+        chunk(near, "core"),           # near-duplicate of 0
+        chunk(base, "module"),         # same text, different doc_type
+        chunk(base, "module"),         # exact duplicate of 3
+        chunk("too short", "module"),  # too few shingles to compare
+    ]
+
+    groups = MinHashDeduplicator(threshold=0.85).group(chunks)
+    assert groups == [[0, 2], [1], [3, 4], [5]], groups
+
+    # A strict threshold keeps the near-duplicate separate
+    groups = MinHashDeduplicator(threshold=0.99).group(chunks)
+    assert [0, 2] not in groups and [3, 4] in groups, groups
+
+    location = {"document": "a.pdf", "page": 1, "chunk_index": 0}
+    assert get_locations(location) == [location]
+
+    print("Near-duplicate checks passed")
+
+def test_query_expand_duplicates():
+    """Test duplicate location expansion"""
+    print("\n=== Testing Duplicate Expansion ===")
+
+    payload = {
+        "question": "What are the requirements for mentor eligibility?",
+        "top_k": 5,
+        "expand_duplicates": True
+    }
+
+    response = requests.post(f"{BASE_URL}/query", json=payload)
+
+    if response.status_code == 200:
+        result = response.json()
+        for i, source in enumerate(result['sources'], 1):
+            locations = source['locations']
+            assert locations, "expand_duplicates should list at least the source's own location"
+            print(f"\n[{i}] {source['document']} (Page {source['page']}) - {len(locations)} location(s)")
+            for loc in locations[1:]:
+                print(f"    also in {loc['document']} p.{loc['page']}")
     else:
         print(f"Error: {response.status_code}")
         print(response.text)
@@ -59,15 +163,43 @@ def test_extract():
         print(f"Error: {response.status_code}")
         print(response.text)
 
+def test_extract_stream():
+    """Test streaming whole-document export"""
+    print("\n=== Testing Extract Streaming ===")
+
+    payload = {
+        "document": "MPP SOP.pdf",
+        "stream": True
+    }
+
+    response = requests.post(f"{BASE_URL}/extract", json=payload, stream=True)
+
+    if response.status_code == 200:
+        lines = [json.loads(line) for line in response.iter_lines() if line]
+        extracts = [line for line in lines if 'text' in line]
+        pages = [extract['page'] for extract in extracts]
+        print(f"\nTotal extracts: {len(extracts)}")
+        print(f"Complete: {bool(lines) and lines[-1] == {'next_cursor': None}}")
+        print(f"Pages: {pages[0]}-{pages[-1]}" if pages else "Pages: none")
+        print(f"In page order: {pages == sorted(pages)}")
+    else:
+        print(f"Error: {response.status_code}")
+        print(response.text)
+
 if __name__ == "__main__":
     print("="*60)
     print("MPP RAG API Test Suite")
     print("="*60)
 
+    test_citation_verifier()
+    test_dedup()
+
     try:
         test_health()
         test_query()
+        test_query_expand_duplicates()
         test_extract()
+        test_extract_stream()
 
         print("\n" + "="*60)
         print("All tests completed!")
@@ -0,0 +1,198 @@
+"""
+Upstream Client for OpenAI calls
+Pooled keep-alive connections, per-call timeouts, jittered retries and hedged embedding requests
+"""
+
+import os
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Callable, Optional
+import httpx
+import openai
+from openai import OpenAI
+
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+UPSTREAM_COUNTERS = ("calls", "errors", "retries", "hedges_sent", "hedge_wins")
+
+
+class LatencyTracker:
+    """Rolling window of call latencies with percentile lookup"""
+
+    def __init__(self, window: int = 1000, counters=UPSTREAM_COUNTERS):
+        self.samples = deque(maxlen=window)
+        self.counters = {name: 0 for name in counters}
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def count(self, name: str):
+        with self.lock:
+            self.counters[name] += 1
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self.lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return None
+        return samples[min(int(len(samples) * pct / 100), len(samples) - 1)]
+
+    def summary(self) -> Dict:
+        summary = dict(self.counters)
+        for pct in (50, 95, 99):
+            value = self.percentile(pct)
+            summary[f"p{pct}_ms"] = round(value * 1000, 1) if value is not None else None
+        return summary
+
+
+class UpstreamClient:
+    def __init__(self, api_key: Optional[str] = None):
+        pool_size = int(os.getenv("UPSTREAM_POOL_SIZE", 20))
+        self.embedding_timeout = float(os.getenv("EMBEDDING_TIMEOUT", 10))
+        self.llm_timeout = float(os.getenv("LLM_TIMEOUT", 120))
+        self.max_retries = int(os.getenv("UPSTREAM_MAX_RETRIES", 3))
+        self.backoff_base = float(os.getenv("UPSTREAM_BACKOFF_BASE", 0.25))
+        self.backoff_max = float(os.getenv("UPSTREAM_BACKOFF_MAX", 4.0))
+        self.hedge_percentile = float(os.getenv("HEDGE_PERCENTILE", 95))
+        self.hedge_min_delay = float(os.getenv("HEDGE_MIN_DELAY", 0.05))
+        self.hedge_min_samples = int(os.getenv("HEDGE_MIN_SAMPLES", 20))
+        self.hedge_enabled = os.getenv("HEDGE_EMBEDDINGS", "true").lower() == "true"
+
+        # One keep-alive pool shared by every request; retries are handled here, not by the SDK
+        http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=60
+            ),
+            timeout=httpx.Timeout(self.llm_timeout, connect=float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 5)))
+        )
+        self.client = OpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+        self.stats = {"embedding": LatencyTracker(), "llm": LatencyTracker()}
+
+    def _call_with_retry(self, stage: str, call: Callable):
+        """Run call with jittered exponential backoff on transient upstream errors"""
+        tracker = self.stats[stage]
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                result = call()
+                tracker.record(time.perf_counter() - start)
+                return result
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                tracker.count("retries")
+                # Full jitter keeps retrying clients from synchronising; a 429 says how long to wait
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                time.sleep(max(delay, self._retry_after(e) or 0))
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        """Seconds requested by a Retry-After (or retry-after-ms) response header"""
+        response = getattr(error, "response", None)
+        if response is None:
+            return None
+        try:
+            if "retry-after-ms" in response.headers:
+                return float(response.headers["retry-after-ms"]) / 1000
+            if "retry-after" in response.headers:
+                return float(response.headers["retry-after"])
+        except ValueError:
+            # HTTP-date form - fall back to backoff
+            pass
+        return None
+
+    def _hedged(self, stage: str, call: Callable):
+        """Send a duplicate request once the primary exceeds the stage's p95 latency"""
+        tracker = self.stats[stage]
+
+        # Too few samples for a meaningful p95 - early calls would almost all be hedged
+        if len(tracker) < self.hedge_min_samples:
+            return self._call_with_retry(stage, call)
+
+        started = threading.Event()
+
+        def run():
+            started.set()
+            return self._call_with_retry(stage, call)
+
+        submitted = time.perf_counter()
+        primary = self.executor.submit(run)
+
+        # Time spent queued for a worker is not upstream latency, so the hedge timer starts
+        # once the call is running. A long queue means the pool is saturated, and a hedge
+        # would only add load.
+        started.wait()
+        delay = max(tracker.percentile(self.hedge_percentile) or self.embedding_timeout, self.hedge_min_delay)
+        if time.perf_counter() - submitted > delay:
+            return primary.result()
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        tracker.count("hedges_sent")
+        hedge = self.executor.submit(self._call_with_retry, stage, call)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        tracker.count("hedge_wins")
+                    return future.result()
+        # Both failed - surface the primary's error
+        return primary.result()
+
+    def embed(self, text: str, model: str) -> List[float]:
+        """Embedding for one text, hedged against slow responses"""
+        self.stats["embedding"].count("calls")
+
+        def call():
+            response = self.client.embeddings.create(model=model, input=text, timeout=self.embedding_timeout)
+            return response.data[0].embedding
+
+        try:
+            if self.hedge_enabled:
+                return self._hedged("embedding", call)
+            return self._call_with_retry("embedding", call)
+        except Exception:
+            # Once per failed call, whatever the error and however many attempts it took
+            self.stats["embedding"].count("errors")
+            raise
+
+    def chat(self, model: str, messages: List[Dict]) -> str:
+        """Chat completion text (not hedged - generation is too expensive to duplicate)"""
+        self.stats["llm"].count("calls")
+
+        def call():
+            response = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                timeout=self.llm_timeout
+            )
+            return response.choices[0].message.content
+
+        try:
+            return self._call_with_retry("llm", call)
+        except Exception:
+            self.stats["llm"].count("errors")
+            raise
+
+    def metrics(self) -> Dict:
+        return {stage: tracker.summary() for stage, tracker in self.stats.items()}